@@ -1,211 +1,404 @@
-import mph
-from pathlib import Path
-import sys
-import csv
 from scipy.optimize import minimize
+from scipy.optimize._differentialevolution import DifferentialEvolutionSolver
+from scipy.stats import qmc
+from sklearn.ensemble import RandomForestRegressor
+import atexit
+import concurrent.futures as cf
+import csv
+import logging
+import multiprocessing
 import os
+import pickle
+import sys
 
-# --- Baseline values from COMSOL GUI ---
-baseline_values = {
-    "V_rf": 300,
-    "V_dc": 50,
-    "V_endcap": 10,
-    "rod_spacing": 0.005,
-    "rod_radius": 0.002,
-    "rod_length": 0.04,
-    "endcap_offset": 0.001,
-    "endcap_rad":0.006,
-    "endcap_thick":0.0005,
-    "f":1e7
-}
-
-# --- Target values for normalization ---
-targets = {
-    "depth_eV": 5.0,     # want >= 5 eV
-    "offset_mm": 0.001,    # want ~0 mm
-    "P_est_mW": 1000.0      # want ~1000 mW
-}
-
-# --- Weights for each objective ---
-weights = {
-    "depth_eV": 1.0,
-    "offset_mm": 10.0,
-    "P_est_mW": 0.8
-}
-
-
-bounds = [
-
-    (0, 1000),      # V_rf
-    (0, 500),      # V_dc
-    (0, 500),        # V_endcap
-    (0.003, 0.1),   # rod_spacing
-    (0.0005, 0.008), # rod_radius
-    (0.02, 0.1),    # rod_length
-    (0.0, 0.01),    # endcap_offset
-    (0.005, 0.01),  # endcap_rad
-    (0.0001, 0.001), # endcap_thick
-    (1e6, 1e8)       # f
-    ]
-
-def find_model_file(preferred_name: str = "3d_pole_trap - Copy.mph") -> Path:
-    cwd = Path(__file__).resolve().parent
-    preferred_path = cwd / preferred_name
-    if preferred_path.exists():
-        print(f"Using model file: {preferred_path}")
-        return preferred_path
-
-    candidates = list(cwd.glob("*.mph"))
-    if candidates:
-        print("Preferred model not found. Available .mph files in the folder:")
-        for i, p in enumerate(candidates, 1):
-            print(f"  {i}. {p.name}")
-        fallback = candidates[0]
-        print(f"Falling back to: {fallback}")
-        return fallback
-
-    print(f"No .mph model file found in {cwd}. Please place your COMSOL model there or provide the correct path.")
-    sys.exit(2)
-
-def try_eval(model, name):
-    try:
-        return float(model.evaluate(name))
-    except Exception:
-        return None
-    
-def objective(depth_eV, offset_mm, P_est_mW):
-    # Normalized scores relative to targets
-    depth_score  = depth_eV / (targets["depth_eV"] + 1e-9)
-    offset_score = (targets["offset_mm"] + 1e-9) / (offset_mm + 1e-9)
-    power_score  = (targets["P_est_mW"] + 1e-9) / (P_est_mW + 1e-9)
-
-    print(depth_score, offset_score, power_score)
-    print((weights["depth_eV"] * depth_score), \
-          (weights["offset_mm"] * offset_score), \
-          (weights["P_est_mW"] * power_score))
-
-    # Weighted sum
-    score = (weights["depth_eV"] * depth_score) \
-          + (weights["offset_mm"] * offset_score) \
-          + (weights["P_est_mW"] * power_score)
-    return score
-
-def run_trial(params, model, writer, filename):
-    # unpack params
-    V_rf, V_dc, V_endcap, rod_spacing, rod_radius, rod_length, endcap_offset, endcap_rad, endcap_thick, f = params
-
-    # set COMSOL parameters
-    model.parameter("V_rf", V_rf)
-    model.parameter("V_dc", V_dc)
-    model.parameter("V_endcap", V_endcap)
-    model.parameter("rod_spacing", rod_spacing)
-    model.parameter("rod_radius", rod_radius)
-    model.parameter("rod_length", rod_length)
-    model.parameter("endcap_offset", endcap_offset)
-    model.parameter("endcap_rad", endcap_rad)
-    model.parameter("endcap_thick", endcap_thick)
-    model.parameter("f", f)
+import mph
+import numpy as np
+
+from opt_common import (OptimizationSpec, clear_param_cache, configure_logging,
+                        enable_warm_start, find_model_file, set_params,
+                        try_eval_many, weighted_score)
+
+log = logging.getLogger(__name__)
+
+# the 3D pole (rod) trap's problem definition, shared-helper form
+SPEC = OptimizationSpec(
+    name="3d_pole_trap",
+    preferred_model="3d_pole_trap - Copy.mph",
+    param_order=("V_rf", "V_dc", "V_endcap", "rod_spacing", "rod_radius",
+                 "rod_length", "endcap_offset", "endcap_rad", "endcap_thick", "f"),
+    bounds=(
+        (0, 1000),      # V_rf
+        (0, 500),       # V_dc
+        (0, 500),       # V_endcap
+        (0.003, 0.1),   # rod_spacing
+        (0.0005, 0.008),# rod_radius
+        (0.02, 0.1),    # rod_length
+        (0.0, 0.01),    # endcap_offset
+        (0.005, 0.01),  # endcap_rad
+        (0.0001, 0.001),# endcap_thick
+        (1e6, 1e8)      # f
+    ),
+    targets={
+        "depth_eV": 5.0,     # want >= 5 eV
+        "offset_mm": 0.001,  # want ~0 mm
+        "P_est_mW": 1000.0   # want ~1000 mW
+    },
+    weights={
+        "depth_eV": 1.0,
+        "offset_mm": 10.0,
+        "P_est_mW": 0.8
+    },
+    baseline={
+        "V_rf": 300,
+        "V_dc": 50,
+        "V_endcap": 10,
+        "rod_spacing": 0.005,
+        "rod_radius": 0.002,
+        "rod_length": 0.04,
+        "endcap_offset": 0.001,
+        "endcap_rad": 0.006,
+        "endcap_thick": 0.0005,
+        "f": 1e7
+    },
+)
+
+# --- Worker pool: split the licensed cores across independent COMSOL clients ---
+TOTAL_CORES = 8  #THE CORE COUNT IS SO IMPORTANT GODDAMNIT KEEP IT 8
+N_DE_WORKERS = 2
+
+LOG_FILE = "optimization_log.csv"
+DE_CKPT = "de_ckpt.pkl"
+DE_MAXITER = 60
+FIELDNAMES = list(SPEC.param_order) + ["depth_eV", "offset_mm", "P_est_mW", "score"]
+
+# indices into SPEC.param_order used by the analytic pre-filter
+_I_VRF = SPEC.param_order.index("V_rf")
+_I_SPACING = SPEC.param_order.index("rod_spacing")
+_I_RADIUS = SPEC.param_order.index("rod_radius")
+_I_FREQ = SPEC.param_order.index("f")
+
+# Ca-40 ion; the pre-filter is a coarse stability bound, not a precise model
+_E_CHARGE = 1.602176634e-19                    # C
+_ION_MASS = 39.962590866 * 1.66053906660e-27   # kg
+_Q_MAX = 0.908  # Mathieu stability limit of the ideal quadrupole
+
+_filter_hits = 0
+
+def prefilter_reject(params):
+    """Cheap analytic priors that kill a candidate before any solve.
+
+    Geometry: the rods must not overlap (spacing > 2*radius). Stability:
+    the ideal-quadrupole Mathieu parameter q = 2 e V_rf / (m r0^2 W^2),
+    with r0 = rod_spacing and W = 2*pi*f, must stay below ~0.908 or the
+    ion is not trapped no matter what the FEM says. Microseconds per
+    check versus minutes per solve; DE loves boundary-hugging candidates
+    so the hit rate is worth logging.
+    """
+    global _filter_hits
+    r0 = params[_I_SPACING]
+    if r0 <= 2.0 * params[_I_RADIUS]:
+        _filter_hits += 1
+        log.info("Prefilter hit %d: rods overlap (spacing=%g, radius=%g)",
+                 _filter_hits, r0, params[_I_RADIUS])
+        return True
+    omega = 2.0 * np.pi * params[_I_FREQ]
+    q = 2.0 * _E_CHARGE * params[_I_VRF] / (_ION_MASS * r0 * r0 * omega * omega)
+    if q > _Q_MAX:
+        _filter_hits += 1
+        log.info("Prefilter hit %d: Mathieu q=%.3f exceeds %.3f",
+                 _filter_hits, q, _Q_MAX)
+        return True
+    return False
+
+# per-process state, set up once by _init_worker
+_worker_model = None
+_log_fh = None
+_log_writer = None
+_log_rows = 0
+_FLUSH_EVERY = 32
+
+def _init_worker(model_path):
+    """Start one COMSOL client per DE worker process and load the model once.
+
+    Each worker also opens its own append handle on the shared log; rows are
+    short enough that POSIX append writes don't interleave. The handle is
+    large-buffered and flushed every _FLUSH_EVERY rows (and at exit), so
+    logging costs nothing between solves even on network filesystems.
+    """
+    global _worker_model, _log_fh, _log_writer
+    configure_logging()
+    client = mph.start(cores=max(1, TOTAL_CORES // N_DE_WORKERS), version="6.3")
+    _worker_model = client.load(str(model_path))
+    # successive DE candidates differ little; seed each Newton iteration
+    # from the worker's previous converged solution
+    enable_warm_start(_worker_model)
+    _log_fh = open(LOG_FILE, "a", newline="", buffering=1 << 20)
+    # plain writer + tuple rows: no per-row dict building or fieldname lookups
+    _log_writer = csv.writer(_log_fh)
+    atexit.register(_log_fh.close)
+
+def compute_score(depth_eV, offset_mm, P_est_mW):
+    """Score metrics with penalties folded in; scalars or same-shape arrays.
+
+    Everything is NumPy element-wise so a whole generation of candidates can
+    be scored in one call; missing metrics come in as NaN and land on the
+    penalty branch of the np.where.
+    """
+    depth = np.asarray(depth_eV, dtype=float)
+    offset = np.asarray(offset_mm, dtype=float)
+    power = np.asarray(P_est_mW, dtype=float)
+    score = weighted_score(depth, offset, power, SPEC.targets, SPEC.weights)
+    bad = (~np.isfinite(score)
+           | (offset > 15)      # ion nowhere near the trap center
+           | (depth < 0.0001)   # no trapping potential to speak of
+           | (power < 10))      # power probably a lie
+    return np.where(bad, -1e6, score)
+
+def run_trial(params):
+    # params are in PHYSICAL units here, ordered as SPEC.param_order;
+    # runs inside a DE worker process
+    if prefilter_reject(params):
+        return 1e6  # penalty energy, no solve spent
+
+    model = _worker_model
+    # only push values that changed since this worker's last trial; each
+    # model.parameter() call is a JVM round-trip
+    set_params(model, SPEC.param_order, params)
     score = 0
 
-    print("Running trial with params:", params)
+    log.debug("Running trial with params: %s", params)
 
     try:
         model.solve()
-    except Exception as e:
-        print("COMSOL study run failed:", e)
+    except Exception:
+        log.warning("COMSOL study run failed", exc_info=True)
+        # don't trust the model state after a failed solve: re-push everything
+        clear_param_cache()
         score = -1e6
-    
-    print('solved Trial')
-
-    depth_eV   = try_eval(model, "depth_eV")
-    offset_mm  = try_eval(model, "offset_mm")
-    P_est_mW   = try_eval(model, "P_est_mW")
-    print("depth_eV:", depth_eV, "offset_mm:", offset_mm, "P_est_mW:", P_est_mW)
-    
+
+    # one batched evaluate instead of three separate JVM round-trips
+    depth_eV, offset_mm, P_est_mW = try_eval_many(
+        model, ("depth_eV", "offset_mm", "P_est_mW"))
+    log.debug("depth_eV: %s offset_mm: %s P_est_mW: %s", depth_eV, offset_mm, P_est_mW)
+
     if score == -1e6:
-        pass  # keep the penalty score
+        pass  # keep the solve-failure penalty
     else:
-        score = objective(depth_eV, offset_mm, P_est_mW)
-    print("Optimizer result:", -score)
+        score = float(compute_score(np.nan if depth_eV is None else depth_eV,
+                                    np.nan if offset_mm is None else offset_mm,
+                                    np.nan if P_est_mW is None else P_est_mW))
+    log.debug("Optimizer result: %s", -score)
 
-    if offset_mm > 15:
-        print("Offset too high, penalizing")
-        score = -1e6
-    if depth_eV < 0.0001:
-        print("Depth too low, penalizing")
-        score = -1e6
+    try:
+        # write a row through this worker's own append handle
+        global _log_rows
+        _log_writer.writerow(list(params) + [depth_eV, offset_mm, P_est_mW, score])
+        _log_rows += 1
+        if _log_rows % _FLUSH_EVERY == 0:
+            _log_fh.flush()
+    except Exception:
+        log.error("Failed to write row", exc_info=True)
 
-    if P_est_mW < 10:
-        print("Power probably a lie, penalizing")
-        score = -1e6
+    return -score  # minimize negative score
+
+# worker pool used by the vectorized DE objective, set in main()
+_pool = None
+
+# --- Surrogate-assisted evaluation (parent process) ----------------------------
+# Every real COMSOL energy lands in (_sur_X, _sur_y); once there is enough
+# data a random forest ranks each generation and only the most promising
+# fraction is actually solved, the rest keep the forest's prediction. DE only
+# needs the ranking to be roughly right to keep selection pressure, and wrong
+# predictions get corrected whenever those regions become competitive again.
+SUR_MIN_SAMPLES = 40     # pure DE until the forest has something to learn
+SUR_REFIT_EVERY = 16     # real evaluations between refits
+SUR_REAL_FRACTION = 0.5  # fraction of each generation sent to COMSOL
 
+_sur_X = []
+_sur_y = []
+_surrogate = None
+_sur_fit_size = 0
+
+def _record_real(candidates, energies):
+    _sur_X.extend(candidates)
+    _sur_y.extend(energies)
+
+def _maybe_refit_surrogate():
+    global _surrogate, _sur_fit_size
+    if len(_sur_y) < SUR_MIN_SAMPLES or len(_sur_y) - _sur_fit_size < SUR_REFIT_EVERY:
+        return
+    _surrogate = RandomForestRegressor(n_estimators=100, n_jobs=-1)
+    _surrogate.fit(np.asarray(_sur_X), np.asarray(_sur_y))
+    _sur_fit_size = len(_sur_y)
+    log.info("Surrogate refit on %d real evaluations", _sur_fit_size)
+
+def _save_ckpt(solver, generation):
+    """Checkpoint the DE population so an interrupted run can resume."""
     try:
-        # write a row using the provided DictWriter and flush the underlying file
-        writer.writerow({
-                "V_rf": V_rf, "V_dc": V_dc, "V_endcap": V_endcap,
-                "rod_spacing": rod_spacing, "rod_radius": rod_radius,
-                "rod_length": rod_length, "endcap_offset": endcap_offset,""
-                "endcap_rad": endcap_rad, "endcap_thick": endcap_thick, "f": f,
-                "depth_eV": depth_eV, "offset_mm": offset_mm,
-                "P_est_mW": P_est_mW, "score": score
-            })
-        filename.flush()
-        os.fsync(filename.fileno())
-
-        print("Row written")
-    except Exception as e:
-        print("Failed to write row:", e)
+        with open(DE_CKPT, "wb") as fh:
+            pickle.dump({"generation": generation,
+                         "population": solver.population,
+                         "energies": solver.population_energies,
+                         "rng": solver.random_number_generator}, fh)
+    except Exception:
+        log.error("Failed to write DE checkpoint", exc_info=True)
+
+def _restore_ckpt(solver):
+    """Load a saved population into a fresh solver.
+
+    Returns the generation to resume from; 0 on a cold start or when the
+    checkpoint does not match the current problem shape.
+    """
+    try:
+        with open(DE_CKPT, "rb") as fh:
+            ckpt = pickle.load(fh)
+    except FileNotFoundError:
+        return 0
+    except Exception:
+        log.warning("Ignoring unreadable DE checkpoint", exc_info=True)
+        return 0
+    if ckpt["population"].shape != solver.population.shape:
+        log.warning("DE checkpoint shape mismatch; starting fresh")
+        return 0
+    solver.population = ckpt["population"]
+    solver.population_energies = ckpt["energies"]
+    solver.random_number_generator = ckpt["rng"]
+    log.info("Resuming DE from generation %d", ckpt["generation"])
+    return ckpt["generation"]
+
+def run_trial_batch(X):
+    """Vectorized DE objective: X is (n_params,) or (n_params, S) -> (S,) energies.
+
+    The whole subpopulation arrives in one call, so candidates are dispatched
+    across the COMSOL worker pool as a single batch per generation. Once the
+    surrogate is trained, only the SUR_REAL_FRACTION candidates it ranks best
+    are actually solved; the rest return the forest's predicted energy.
+    """
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        candidates = [list(X)]
+    else:
+        candidates = [list(c) for c in X.T]
+
+    _maybe_refit_surrogate()
+    if _surrogate is None or len(candidates) < 4:
+        # cold start, single points (polish) and tiny batches go real
+        energies = np.asarray(_pool.map(run_trial, candidates), dtype=float)
+        _record_real(candidates, energies)
+        return energies
+
+    predicted = _surrogate.predict(np.asarray(candidates))
+    n_real = max(1, int(np.ceil(SUR_REAL_FRACTION * len(candidates))))
+    real_idx = np.argsort(predicted)[:n_real]  # lowest predicted energy first
+    real_energies = _pool.map(run_trial, [candidates[i] for i in real_idx])
+    _record_real([candidates[i] for i in real_idx], real_energies)
+    energies = predicted
+    energies[real_idx] = real_energies
+    return energies
+
+def _powell_from(x0):
+    """One bounded Powell descent; runs inside a worker with its own client."""
+    res = minimize(run_trial, x0, method="Powell", bounds=list(SPEC.bounds),
+                   options={"maxfev": 100, "xtol": 1e-3})
+    return res.fun, list(res.x)
+
+def run_multistart(model_path, n_starts=N_DE_WORKERS):
+    """Buckshot-style search: independent Powell runs from an LHS design.
+
+    Powell alone stalls in the flat multi-metric landscape; launching it
+    from several Latin-hypercube starts in parallel COMSOL clients trades
+    the stuck-in-one-basin failure mode for wall-clock-parallel restarts.
+    Capped at N_DE_WORKERS so the core budget stays at TOTAL_CORES.
+    """
+    design = qmc.LatinHypercube(d=len(SPEC.bounds), seed=0).random(n_starts)
+    starts = (SPEC.low + design * SPEC.span).tolist()
+    with cf.ProcessPoolExecutor(max_workers=n_starts,
+                                initializer=_init_worker,
+                                initargs=(model_path,)) as pool:
+        results = list(pool.map(_powell_from, starts))
+    best_fun, best_x = min(results, key=lambda r: r[0])
+    print("Best multistart energy:", best_fun)
+    print("Best physical parameters:", best_x)
 
-    return -score  # minimize negative score
 def main():
-    model_path = find_model_file()
-    print("Starting COMSOL client...")
-    client = mph.start(cores=8, version="6.3") #THE CORE COUNT IS SO IMPORTANT GODDAMNIT KEEP IT 8
+    configure_logging()
+    model_path = find_model_file(SPEC.preferred_model)
+
+    # header first; workers append rows from their own handles. Only truncate
+    # on a cold start: a resumed run keeps the trial history its checkpoint
+    # belongs to.
+    if not (os.path.exists(DE_CKPT) and os.path.exists(LOG_FILE)):
+        with open(LOG_FILE, "w", newline="") as fh:
+            csv.writer(fh).writerow(FIELDNAMES)
 
+    if "--multistart" in sys.argv[1:]:
+        run_multistart(model_path)
+        return
+
+    global _pool
+    print(f"Starting {N_DE_WORKERS} COMSOL workers...")
+    with multiprocessing.Pool(processes=N_DE_WORKERS,
+                              initializer=_init_worker,
+                              initargs=(model_path,)) as pool:
+        _pool = pool
+        # explicit solver loop instead of differential_evolution() so the
+        # population can be checkpointed after every generation: license
+        # expiry or a reboot then costs at most one generation of solves.
+        # Sobol init covers the space better per solve than random init, and
+        # the trimmed budget leans on the early stop + final polish.
+        solver = DifferentialEvolutionSolver(run_trial_batch,
+                                             bounds=list(SPEC.bounds),
+                                             x0=SPEC.x0(),
+                                             init='sobol',
+                                             popsize=8,
+                                             maxiter=DE_MAXITER,
+                                             tol=1e-3,
+                                             polish=False,
+                                             seed=42,
+                                             updating='deferred',
+                                             vectorized=True)
+        start_gen = _restore_ckpt(solver)
+        with solver:
+            for gen in range(start_gen, DE_MAXITER):
+                next(solver)
+                _save_ckpt(solver, gen + 1)
+                convergence = solver.convergence
+                # one progress line per generation, not per candidate
+                print(f"DE generation {gen + 1}, convergence={convergence:.3f}, "
+                      f"best={solver.population_energies[0]:.4g}")
+                # solver.convergence is std/|mean| of the energies and
+                # falls toward 0 as the population collapses; this mirrors
+                # the callback-form early stop (tol / convergence > 0.9),
+                # after which further generations just burn solves the
+                # polish step does better
+                if solver.converged() or convergence < solver.tol / 0.9:
+                    break
+        # one bounded Powell descent from the DE winner replaces DE's
+        # built-in L-BFGS-B polish, which approximates gradients with
+        # extra COMSOL solves per step
+        polished = minimize(lambda x: float(run_trial_batch(x)[0]),
+                            solver.x, method="Powell",
+                            bounds=list(SPEC.bounds),
+                            options={"maxfev": 50, "xtol": 1e-3})
+        _pool = None
+        # close+join so the workers exit normally and their atexit hooks
+        # drain the buffered log handles; leaving it to the context
+        # manager's terminate() would SIGTERM them mid-buffer and drop
+        # the final rows (exactly the polish trials around the best point)
+        pool.close()
+        pool.join()
+
+    # the run finished: drop the checkpoint so only interrupted runs resume
+    # (a stale one would restore the converged population, trip the early
+    # stop immediately and keep the log from ever being reset)
     try:
-        print(f"Loading model: {model_path}")
-        model = client.load(str(model_path))
-
-        # --- Print all COMSOL parameters (expression + value) ---
-        print("\n📋 All COMSOL parameters:")
-        exprs = model.parameters()
-        for name, expr in exprs.items():
-            val = model.parameter(name)
-            print(f"  {name:<20} | Expression: {expr:<10} | Value: {val}")
-        x0 = [baseline_values["V_rf"], baseline_values["V_dc"], baseline_values["V_endcap"],
-                  baseline_values["rod_spacing"], baseline_values["rod_radius"],
-                  baseline_values["rod_length"], baseline_values["endcap_offset"],
-                  baseline_values["endcap_rad"],baseline_values["endcap_thick"],
-                  baseline_values["f"]]
-
-            
-
-        with open("optimization_log.csv", "w", newline="") as filename:
-            fieldnames = ["V_rf","V_dc","V_endcap","rod_spacing","rod_radius",
-                                "rod_length","endcap_offset", "endcap_rad","endcap_thick","f",
-                                "depth_eV","offset_mm","P_est_mW","score"]
-            writer = csv.DictWriter(filename, fieldnames=fieldnames)
-            writer.writeheader()
-
-            # run optimizer, passing both the DictWriter and the open file handle for flushing
-            result = minimize( lambda p: run_trial(p, model, writer, filename),
-                        x0,
-                        method="SLSQP",
-                        bounds=bounds,
-                        options={"maxiter": 5000})
-        
-        
-        model.save()
-        client.remove(model)
-
-    except Exception as e:
-        print("❌ Exception occurred:")
-        print(e)
-        try:
-            client.remove_all()
-        except Exception:
-            pass
-        raise
+        os.remove(DE_CKPT)
+    except FileNotFoundError:
+        pass
+
+    print("Best DE energy:", solver.population_energies[0])
+    print("Polished energy:", polished.fun)
+    print("Best physical parameters:", list(polished.x))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
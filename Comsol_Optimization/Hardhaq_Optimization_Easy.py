@@ -1,10 +1,30 @@
 import mph
-from pathlib import Path
 import sys
-import csv
-from scipy.optimize import minimize
-import os
+import logging
+import pandas as pd
+from scipy.stats import qmc
+import concurrent.futures as cf
+import multiprocessing
+from async_csv import AsyncCsvLogger
+from opt_common import (OptimizationSpec, configure_logging, find_model_file,
+                        try_eval_many, set_params, clear_param_cache,
+                        enable_warm_start)
+from skopt import Optimizer
+from skopt.space import Real
+import pickle
 import traceback
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except Exception:
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        # no-op fallback so the script still runs without numba
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+log = logging.getLogger(__name__)
 
 # --- Baseline values from COMSOL GUI ---
 baseline_values = {
@@ -34,6 +54,10 @@ weights = {
     "P_est_mW": 0.8
 }
 
+# --- COMSOL parameter names, in the same order as the bounds/vectors ---
+PARAM_ORDER = ["V_rf", "V_dc", "V_endcap", "electrode_spacing", "electrode_amplitude",
+               "umax", "endcap_offset", "endcap_rad", "endcap_thick", "f"]
+
 # --- Bounds in physical units ---
 bounds = [
     (0, 1000),      # V_rf
@@ -48,202 +72,301 @@ bounds = [
     (1e6, 1e8)      # f
 ]
 
-# --- Normalization helpers ---
-def normalize(x, bounds):
-    return [(xi - low) / (high - low) for xi, (low, high) in zip(x, bounds)]
-
-def denormalize(y, bounds):
-    return [low + yi * (high - low) for yi, (low, high) in zip(y, bounds)]
-
-def find_model_file(preferred_name: str = "hyperb_electrode_shape_drafting_HARDLIMITCOPY.mph") -> Path:
-    cwd = Path(__file__).resolve().parent
-    preferred_path = cwd / preferred_name
-    if preferred_path.exists():
-        print(f"Using model file: {preferred_path}")
-        return preferred_path
-
-    candidates = list(cwd.glob("*.mph"))
-    if candidates:
-        print("Preferred model not found. Available .mph files in the folder:")
-        for i, p in enumerate(candidates, 1):
-            print(f"  {i}. {p.name}")
-        fallback = candidates[0]
-        print(f"Falling back to: {fallback}")
-        return fallback
-
-    print(f"No .mph model file found in {cwd}. Please place your COMSOL model there or provide the correct path.")
-    sys.exit(2)
-
+# the hyperbolic-electrode trap's problem definition, shared-helper form
+SPEC = OptimizationSpec(
+    name="hyperb_electrode",
+    preferred_model="hyperb_electrode_shape_drafting_HARDLIMITCOPY.mph",
+    param_order=tuple(PARAM_ORDER),
+    bounds=tuple(bounds),
+    targets=targets,
+    weights=weights,
+    baseline=baseline_values,
+)
+
+# positions of the parameters used by the cheap feasibility pre-check
+_I_VRF = PARAM_ORDER.index("V_rf")
+_I_ENDCAP_RAD = PARAM_ORDER.index("endcap_rad")
+_I_ENDCAP_THICK = PARAM_ORDER.index("endcap_thick")
+
+def is_infeasible(params):
+    """Cheap a-priori reject for parameter sets certain to earn the penalty.
+
+    Predicates are deliberately conservative: a false positive silently
+    throws away a potentially good COMSOL solve.
+    """
+    if params[_I_VRF] < 5.0:
+        return True  # essentially no RF drive; trap depth will be ~0
+    if params[_I_ENDCAP_RAD] <= params[_I_ENDCAP_THICK]:
+        return True  # degenerate endcap geometry
+    return False
+
+# bounds as arrays, for mapping unit-box designs into physical units
+_LOW = SPEC.low
+_SPAN = SPEC.span
+
+# --- Surrogate optimizer budget (real COMSOL solves, excluding the baseline) ---
+N_TRIALS = 60
+N_INITIAL = 10  # random/space-filling points before the GP takes over
+N_SOBOL = 16    # cold-start space-filling design when no history exists
+
+# --- Worker pool: split the licensed cores across independent COMSOL clients ---
+TOTAL_CORES = 8
+N_WORKERS = 2
+
+# --- Memoized trials: rounded parameter tuple -> (depth_eV, offset_mm, P_est_mW, score) ---
+# The GP re-probes near-identical points; identical requests replay the cached
+# metrics instead of paying another COMSOL solve.
+_trial_cache = {}
+_cache_hits = 0
+_CACHE_FILE = "trial_cache.pkl"
+
+def _cache_key(params):
+    # 6 decimals is well below any physically meaningful parameter change,
+    # so re-probes that differ only by optimizer noise collapse to one key
+    return tuple(round(float(v), 6) for v in params)
+
+def _load_trial_cache():
+    try:
+        with open(_CACHE_FILE, "rb") as fh:
+            _trial_cache.update(pickle.load(fh))
+        log.info("Loaded %d cached trial(s) from %s", len(_trial_cache), _CACHE_FILE)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        log.warning("Could not load trial cache", exc_info=True)
 
-    
-def try_eval(model, name):
+def _save_trial_cache():
     try:
-        val = model.evaluate(name)
-        if val is None:
-            return None
-        # handle numpy scalars or single-element arrays returned by COMSOL
-        try:
-            if hasattr(val, "item"):
-                return float(val.item())
-            return float(val)
-        except Exception:
-            # last resort: attempt conversion of first element
-            try:
-                return float(val[0])
-            except Exception:
-                return None
+        with open(_CACHE_FILE, "wb") as fh:
+            pickle.dump(_trial_cache, fh)
     except Exception:
-        return None
-    
+        log.warning("Could not save trial cache", exc_info=True)
+
+# per-process COMSOL model handle, set up once by _init_worker
+_worker_model = None
+
+def _init_worker(model_path, port_queue):
+    """Connect this worker to its own COMSOL server and load the model.
+
+    Client/server mode keeps the JVMs hosted by the parent; each worker
+    takes one port off the queue because a COMSOL server accepts only a
+    single client connection, so parallel sessions need a server apiece.
+    """
+    global _worker_model
+    configure_logging()
+    port = port_queue.get()
+    log.info("Worker connecting to COMSOL server on port %s", port)
+    client = mph.Client(cores=max(1, TOTAL_CORES // N_WORKERS), port=port)
+    _worker_model = client.load(str(model_path))
+    enable_warm_start(_worker_model)
+    # snapshot the parameter metadata in one pass instead of per-name JVM reads
+    exprs = dict(_worker_model.parameters())
+    log.debug("Model parameters: %s", exprs)
+
+# targets/weights hoisted to float constants so the scoring kernel has no
+# dict lookups and can be compiled by numba
+_T_DEPTH = float(targets["depth_eV"])
+_T_OFFSET = float(targets["offset_mm"])
+_T_POWER = float(targets["P_est_mW"])
+_W_DEPTH = float(weights["depth_eV"])
+_W_OFFSET = float(weights["offset_mm"])
+_W_POWER = float(weights["P_est_mW"])
+
+@njit(cache=True)
 def objective(depth_eV, offset_mm, P_est_mW):
-    # Normalized scores relative to targets
-    depth_score  = depth_eV / (targets["depth_eV"] + 1e-9)
-    offset_score = (targets["offset_mm"] + 1e-9) / (offset_mm + 1e-9)
-    power_score  = (targets["P_est_mW"] + 1e-9) / (P_est_mW + 1e-9)
-
-    print(depth_score, offset_score, power_score)
-    print((weights["depth_eV"] * depth_score),
-          (weights["offset_mm"] * offset_score),
-          (weights["P_est_mW"] * power_score))
-
-    # Weighted sum
-    score = (weights["depth_eV"] * depth_score
-           + weights["offset_mm"] * offset_score
-           + weights["P_est_mW"] * power_score)
-    return score
-
-def run_trial(params, model, writer, filename):
-    # params are in PHYSICAL units here
-    V_rf, V_dc, V_endcap, electrode_spacing, electrode_amplitude, umax, endcap_offset, endcap_rad, endcap_thick, f = params
-
-    # set COMSOL parameters
-    model.parameter("V_rf", V_rf)
-    model.parameter("V_dc", V_dc)
-    model.parameter("V_endcap", V_endcap)
-    model.parameter("electrode_spacing", electrode_spacing)
-    model.parameter("electrode_amplitude", electrode_amplitude)
-    model.parameter("umax", umax)
-    model.parameter("endcap_offset", endcap_offset)
-    model.parameter("endcap_rad", endcap_rad)
-    model.parameter("endcap_thick", endcap_thick)
-    model.parameter("f", f)
+    # Normalized scores relative to targets, weighted sum
+    depth_score  = depth_eV / (_T_DEPTH + 1e-9)
+    offset_score = (_T_OFFSET + 1e-9) / (offset_mm + 1e-9)
+    power_score  = (_T_POWER + 1e-9) / (P_est_mW + 1e-9)
+    return (_W_DEPTH * depth_score
+          + _W_OFFSET * offset_score
+          + _W_POWER * power_score)
+
+def run_trial(params):
+    # params are in PHYSICAL units here, ordered as PARAM_ORDER;
+    # runs inside a worker process
+    model = _worker_model
+
+    # set COMSOL parameters (only the ones that actually changed)
+    set_params(model, PARAM_ORDER, params)
     score = 0
 
-    print("Running trial with params:", params)
+    log.debug("Running trial with params: %s", params)
 
     try:
         model.solve()
-    except Exception as e:
-        print("COMSOL study run failed:", e)
-        score = -1e6
-    
-    print('solved Trial')
+    except Exception:
+        # a warm start can diverge on a big parameter jump: drop the stale
+        # solution data and retry once from a cold start
+        log.warning("COMSOL solve failed; retrying cold", exc_info=True)
+        clear_param_cache()
+        try:
+            model.java.sol("sol1").clearSolutionData()
+            model.solve()
+        except Exception:
+            log.warning("Cold retry failed too", exc_info=True)
+            score = -1e6
+
+    log.debug("solved Trial")
 
-    depth_eV   = try_eval(model, "depth_eV")
-    offset_mm  = try_eval(model, "offset_mm")
-    P_est_mW   = try_eval(model, "P_est_mW")
-    print("depth_eV:", depth_eV, "offset_mm:", offset_mm, "P_est_mW:", P_est_mW)
+    # one bridge crossing for all three metrics
+    depth_eV, offset_mm, P_est_mW = try_eval_many(model, ("depth_eV", "offset_mm", "P_est_mW"))
+    log.debug("depth_eV: %s offset_mm: %s P_est_mW: %s", depth_eV, offset_mm, P_est_mW)
 
     # If the solve failed to produce scalars, penalize this trial
     if score == -1e6:
         pass
     else:
         if depth_eV is None or offset_mm is None or P_est_mW is None:
-            print("Missing metric(s); applying penalty")
+            log.debug("Missing metric(s); applying penalty")
             score = -1e6
         else:
             score = objective(depth_eV, offset_mm, P_est_mW)
-    print("Optimizer result:", -score)
+    log.debug("Optimizer result: %s", -score)
 
     # safe numeric checks (guard against None)
     if offset_mm is None or offset_mm > 19.13:
-        print("Offset missing or too high, penalizing")
+        log.debug("Offset missing or too high, penalizing")
         score = -1e6
     if depth_eV is None or depth_eV < 0.00001:
-        print("Depth missing or too low, penalizing")
+        log.debug("Depth missing or too low, penalizing")
         score = -1e6
     if P_est_mW is None:
-        print("Power missing or too low, penalizing")
+        log.debug("Power missing or too low, penalizing")
         score = -1e6
 
-    try:
-        writer.writerow({
-                "V_rf": V_rf, "V_dc": V_dc, "V_endcap": V_endcap,
-                "electrode_spacing": electrode_spacing, "electrode_amplitude": electrode_amplitude,
-                "umax": umax, "endcap_offset": endcap_offset,
-                "endcap_rad": endcap_rad, "endcap_thick": endcap_thick, "f": f,
-                "depth_eV": depth_eV, "offset_mm": offset_mm,
-                "P_est_mW": P_est_mW, "score": score
-            })
-        # flush to disk
-        try:
-            filename.flush()
-            os.fsync(filename.fileno())
-        except Exception:
-            pass
-        print("Row written")
-    except Exception as e:
-        print("Failed to write row:", e)
+    # CSV logging happens in the parent so the file has a single writer
+    return depth_eV, offset_mm, P_est_mW, score
 
-    return -score  # minimize negative score
+def _history_points(log_file="optimization_log.csv"):
+    """Load (params, -score) pairs from a previous run's log, if compatible.
 
-def normalized_objective(y, model, writer, filename):
-    # y is in [0,1]^n
-    x = denormalize(y, bounds)  # convert to physical units
-    return run_trial(x, model, writer, filename)
+    Rows with penalty scores or out-of-bounds parameters are dropped; a log
+    whose header doesn't match the current schema is ignored entirely.
+    """
+    try:
+        df = pd.read_csv(log_file)
+    except Exception:
+        return []
+    if list(df.columns[:len(PARAM_ORDER)]) != PARAM_ORDER or "score" not in df.columns:
+        log.warning("Ignoring %s: columns don't match the current schema", log_file)
+        return []
+    df = df[df["score"] > -1e5]
+    points = []
+    for _, row in df.iterrows():
+        params = [float(row[n]) for n in PARAM_ORDER]
+        if all(low <= v <= high for v, (low, high) in zip(params, bounds)):
+            points.append((params, -float(row["score"])))
+    return points
 
 def main():
-    model_path = find_model_file()
-    print("Starting COMSOL client...")
-    client = mph.start(cores=8, version="6.3")
+    configure_logging()
+    model_path = find_model_file(SPEC.preferred_model)
+
+    # grab history before the logger truncates the log file
+    history = _history_points()
+
+    # baseline in physical units
+    x0 = SPEC.x0()
+
+    # GP surrogate over the physical bounds; EI picks where COMSOL actually runs
+    dimensions = [Real(low, high) for low, high in bounds]
+    opt = Optimizer(dimensions, base_estimator="GP", acq_func="EI",
+                    n_initial_points=N_INITIAL, random_state=0)
+
+    # replay past evaluations into the surrogate instead of re-solving them
+    if history:
+        log.info("Warm-starting surrogate with %d logged evaluation(s)", len(history))
+        for params, fval in history:
+            opt.tell(params, fval)
 
     try:
-        print(f"Loading model: {model_path}")
-        model = client.load(str(model_path))
-
-        print("\n📋 All COMSOL parameters:")
-        exprs = model.parameters()
-        for name, expr in exprs.items():
-            val = model.parameter(name)
-            print(f"  {name:<20} | Expression: {expr:<10} | Value: {val}")
-
-        # baseline in physical units
-        x0 = [baseline_values["V_rf"], baseline_values["V_dc"], baseline_values["V_endcap"],
-              baseline_values["electrode_spacing"], baseline_values["electrode_amplitude"],
-              baseline_values["umax"], baseline_values["endcap_offset"],
-              baseline_values["endcap_rad"], baseline_values["endcap_thick"],
-              baseline_values["f"]]
-
-        # normalize baseline
-        y0 = normalize(x0, bounds)
-
-        with open("optimization_log.csv", "w", newline="") as filename:
-            fieldnames = ["V_rf","V_dc","V_endcap","electrode_spacing","electrode_amplitude",
-                          "umax","endcap_offset","endcap_rad","endcap_thick","f",
-                          "depth_eV","offset_mm","P_est_mW","score"]
-            writer = csv.DictWriter(filename, fieldnames=fieldnames)
-            writer.writeheader()
-
-            # run optimizer in normalized space
-            result = minimize(lambda y: normalized_objective(y, model, writer, filename),
-                              y0,
-                              method="Nelder-Mead",
-                              options={"maxiter": 2000, "xatol": 1e-9, "fatol": 1e-9})
-
-        print("Optimization result (normalized):", result)
-        best_params = denormalize(result.x, bounds)
-        print("Best physical parameters:", best_params)
-
-        model.save()
-        client.remove(model)
+        fieldnames = PARAM_ORDER + ["depth_eV","offset_mm","P_est_mW","score","cached","rejected"]
+        with AsyncCsvLogger("optimization_log.csv", fieldnames, fsync_every=10) as logger:
+
+            def log_row(params, depth_eV, offset_mm, P_est_mW, score, cached=0, rejected=0):
+                # values in fieldname order: PARAM_ORDER then the metrics
+                logger.writerow(list(params) + [depth_eV, offset_mm, P_est_mW, score, cached, rejected])
+
+            _load_trial_cache()
+            # one server per worker: a COMSOL server accepts a single client
+            # connection, so parallel sessions each need their own
+            cores_per_worker = max(1, TOTAL_CORES // N_WORKERS)
+            log.info("Starting %d COMSOL server(s) on %d core(s) each...",
+                     N_WORKERS, cores_per_worker)
+            servers = [mph.Server(cores=cores_per_worker, version="6.3")
+                       for _ in range(N_WORKERS)]
+            port_queue = multiprocessing.Queue()
+            for srv in servers:
+                port_queue.put(srv.port)
+            log.info("Starting %d COMSOL workers on port(s) %s...",
+                     N_WORKERS, ", ".join(str(srv.port) for srv in servers))
+            try:
+                with cf.ProcessPoolExecutor(max_workers=N_WORKERS,
+                                            initializer=_init_worker,
+                                            initargs=(model_path, port_queue)) as pool:
+
+                    def evaluate_batch(points):
+                        futures = {}
+                        for p in points:
+                            params = [float(v) for v in p]
+                            if is_infeasible(params):
+                                log.debug("Rejected a priori, skipping solve: %s", params)
+                                log_row(params, None, None, None, -1e6, rejected=1)
+                                opt.tell(p, 1e6)
+                                continue
+                            key = _cache_key(params)
+                            if key in _trial_cache:
+                                global _cache_hits
+                                _cache_hits += 1
+                                depth_eV, offset_mm, P_est_mW, score = _trial_cache[key]
+                                log.debug("Cache hit; replaying trial without a solve")
+                                log_row(params, depth_eV, offset_mm, P_est_mW, score, cached=1)
+                                opt.tell(p, -score)
+                            else:
+                                futures[pool.submit(run_trial, params)] = p
+                        for fut in cf.as_completed(futures):
+                            p = futures[fut]
+                            params = [float(v) for v in p]
+                            depth_eV, offset_mm, P_est_mW, score = fut.result()
+                            _trial_cache[_cache_key(params)] = (depth_eV, offset_mm, P_est_mW, score)
+                            log_row(params, depth_eV, offset_mm, P_est_mW, score)
+                            opt.tell(p, -score)
+                        _save_trial_cache()
+
+                    # seed the surrogate: the GUI baseline, plus a Sobol design
+                    # on cold starts where no logged history was available
+                    evaluate_batch([x0])
+                    if not history:
+                        log.info("No usable history; evaluating a %d-point Sobol design", N_SOBOL)
+                        design = qmc.Sobol(d=len(bounds), scramble=True, seed=0).random(N_SOBOL)
+                        seeds = (_LOW + design * _SPAN).tolist()
+                        for i in range(0, len(seeds), N_WORKERS):
+                            evaluate_batch(seeds[i:i + N_WORKERS])
+
+                    # batched ask/tell loop: constant-liar picks N_WORKERS points per round
+                    done = 0
+                    while done < N_TRIALS:
+                        n = min(N_WORKERS, N_TRIALS - done)
+                        evaluate_batch(opt.ask(n_points=n, strategy="cl_min"))
+                        done += n
+
+            finally:
+                for srv in servers:
+                    try:
+                        srv.stop()
+                    except Exception:
+                        log.warning("Could not stop COMSOL server on port %s",
+                                    srv.port, exc_info=True)
+
+        result = opt.get_result()
+        log.info("Trial cache: %d hit(s), %d stored point(s)", _cache_hits, len(_trial_cache))
+        print("Optimization result:", result.fun)
+        print("Best physical parameters:", result.x)
 
-    except Exception as e:
-        print("❌ Exception occurred:")
+    except Exception:
+        log.error("❌ Exception occurred:")
         traceback.print_exc()
-        try:
-            client.stop()
-        except Exception:
-            pass
         return 1
     return 0
 if __name__ == "__main__":
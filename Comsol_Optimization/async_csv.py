@@ -0,0 +1,67 @@
+import csv
+import os
+import queue
+import threading
+
+
+class AsyncCsvLogger:
+    """Background-thread CSV writer for the optimization logs.
+
+    Rows are plain sequences in fieldname order (no per-row dict building or
+    fieldname lookups). writerow() only enqueues the row; a daemon thread writes and
+    fsyncs every `fsync_every` rows, so the optimizer thread never blocks on
+    disk latency between COMSOL solves. Use as a context manager so the queue
+    is drained and the file closed on exit.
+    """
+
+    _SENTINEL = object()
+
+    def __init__(self, path, fieldnames, fsync_every=10, maxsize=1024):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.fsync_every = fsync_every
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._fh = None
+
+    def __enter__(self):
+        self._fh = open(self.path, "w", newline="")
+        writer = csv.writer(self._fh)
+        writer.writerow(self.fieldnames)
+        self._thread = threading.Thread(target=self._drain, args=(writer,), daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queue.put(self._SENTINEL)
+        self._thread.join()
+        self._fh.close()
+        return False
+
+    def writerow(self, row):
+        """Queue one row (a sequence of values in fieldname order) for writing."""
+        self._queue.put(row)
+
+    def _drain(self, writer):
+        pending = 0
+        while True:
+            row = self._queue.get()
+            if row is self._SENTINEL:
+                break
+            try:
+                writer.writerow(row)
+                pending += 1
+                if pending >= self.fsync_every:
+                    self._sync()
+                    pending = 0
+            except Exception as e:
+                print("Failed to write row:", e)
+        if pending:
+            self._sync()
+
+    def _sync(self):
+        try:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        except Exception:
+            pass
@@ -0,0 +1,174 @@
+"""Shared infrastructure for the COMSOL trap-optimization scripts.
+
+Each script used to carry its own copy of the model-file discovery, the
+metric evaluation helpers, the weighted scoring and the client lifecycle
+code, so every fix had to be applied several times. The per-trap
+configuration (parameter names, bounds, targets, weights, GUI baseline)
+lives in an OptimizationSpec defined by each script; everything generic
+lives here.
+"""
+
+import logging
+import os
+import sys
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def configure_logging():
+    # default WARNING keeps production runs quiet; COMSOL_OPT_LOG=DEBUG for trace
+    logging.basicConfig(level=os.environ.get("COMSOL_OPT_LOG", "WARNING"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+@dataclass
+class OptimizationSpec:
+    """One trap geometry's optimization problem: names, bounds and scoring."""
+
+    name: str
+    preferred_model: str
+    param_order: tuple
+    bounds: tuple          # ((low, high), ...) aligned with param_order
+    targets: dict
+    weights: dict
+    baseline: dict
+
+    # derived arrays, filled in __post_init__
+    low: np.ndarray = field(init=False, repr=False)
+    high: np.ndarray = field(init=False, repr=False)
+    span: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.low = np.array([b[0] for b in self.bounds], dtype=float)
+        self.high = np.array([b[1] for b in self.bounds], dtype=float)
+        self.span = self.high - self.low
+
+    def x0(self):
+        """GUI baseline as a parameter vector in param_order."""
+        return [self.baseline[name] for name in self.param_order]
+
+
+@lru_cache(maxsize=4)
+def find_model_file(preferred_name: str) -> Path:
+    # one scandir pass instead of exists() + glob(): on network shares each
+    # extra stat is a round-trip, and the directory listing already proves
+    # which files exist
+    cwd = Path(__file__).resolve().parent
+    candidates = []
+    with os.scandir(cwd) as it:
+        for entry in it:
+            if entry.name == preferred_name:
+                log.info("Using model file: %s", cwd / preferred_name)
+                return cwd / preferred_name
+            if entry.name.endswith(".mph"):
+                candidates.append(entry.name)
+
+    if candidates:
+        log.warning("Preferred model not found. Available .mph files: %s",
+                    ", ".join(candidates))
+        fallback = cwd / candidates[0]
+        log.warning("Falling back to: %s", fallback)
+        return fallback
+
+    log.error("No .mph model file found in %s. Please place your COMSOL model there or provide the correct path.", cwd)
+    sys.exit(2)
+
+
+def try_eval(model, name):
+    try:
+        val = model.evaluate(name)
+        if val is None:
+            return None
+        # handle numpy scalars or single-element arrays returned by COMSOL
+        try:
+            if hasattr(val, "item"):
+                return float(val.item())
+            return float(val)
+        except Exception:
+            # last resort: attempt conversion of first element
+            try:
+                return float(val[0])
+            except Exception:
+                return None
+    except Exception:
+        return None
+
+
+def try_eval_many(model, names):
+    """Evaluate several expressions in one JVM round-trip.
+
+    Falls back to per-name try_eval() if the binding rejects the list
+    argument or returns something unexpected.
+    """
+    try:
+        vals = model.evaluate(list(names))
+        out = []
+        for val in vals:
+            try:
+                out.append(float(val.item()) if hasattr(val, "item") else float(val))
+            except Exception:
+                try:
+                    out.append(float(val[0]))
+                except Exception:
+                    out.append(None)
+        if len(out) == len(names):
+            return tuple(out)
+    except Exception:
+        pass
+    return tuple(try_eval(model, name) for name in names)
+
+
+def weighted_score(depth_eV, offset_mm, P_est_mW, targets, weights):
+    """Weighted sum of target-normalized scores; works on scalars or arrays."""
+    depth_score = depth_eV / (targets["depth_eV"] + 1e-9)
+    offset_score = (targets["offset_mm"] + 1e-9) / (offset_mm + 1e-9)
+    power_score = (targets["P_est_mW"] + 1e-9) / (P_est_mW + 1e-9)
+    return (weights["depth_eV"] * depth_score
+            + weights["offset_mm"] * offset_score
+            + weights["P_est_mW"] * power_score)
+
+
+# last value pushed to COMSOL per parameter name (per process)
+_last_params = {}
+
+
+def set_params(model, names, values):
+    """Set COMSOL parameters, skipping values unchanged since the last trial.
+
+    Each model.parameter() call is a JPype round-trip to the JVM; when the
+    optimizer barely moves a coordinate most of the writes are no-ops.
+    MPh offers no bulk setter — Model.parameters() is a getter (its first
+    positional argument is the evaluate flag) — so the changed subset is
+    written one name at a time and recorded only after each write.
+    """
+    for name, value in zip(names, values):
+        if _last_params.get(name) != value:
+            model.parameter(name, value)
+            _last_params[name] = value
+
+
+def clear_param_cache():
+    """Forget cached parameter values (e.g. after a failed solve)."""
+    _last_params.clear()
+
+
+def enable_warm_start(model):
+    """Reuse the previous solution as the nonlinear solver's initial guess.
+
+    Successive optimizer candidates differ only slightly, so starting the
+    Newton iteration from the last converged solution cuts iteration count
+    on smooth regions. Best effort: older models may name the nodes
+    differently, in which case solves stay cold.
+    """
+    try:
+        feature = model.java.sol("sol1").feature("s1")
+        feature.set("useinitsol", "on")
+        feature.set("initmethod", "sol")
+        log.info("Solver warm-start enabled")
+    except Exception:
+        log.warning("Could not enable solver warm-start; solves stay cold", exc_info=True)
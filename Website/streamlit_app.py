@@ -12,9 +12,8 @@ except Exception:
     WATCHDOG_AVAILABLE = False
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.colors as mcolors
+import plotly.express as px
 PARAM_FILENAME_RE = re.compile(r"(?P<param>[A-Za-z0-9_]+)_(?P<value>-?\d+(?:\.\d+)?)(?:.*)?\.txt$", re.IGNORECASE)
 
 # file extensions to ignore (explicitly do not open/parse these)
@@ -206,19 +205,13 @@ def extract_numeric_table(text: str):
     if rest_fracs and first_frac < 0.5 and (sum(1 for f in rest_fracs if f > 0.5) >= max(1, len(rest_fracs) // 2)):
         header = True
 
-    import numpy as np
-    data = []
-    for r in (norm_rows[1:] if header else norm_rows):
-        row_vals = []
-        for tok in r:
-            if is_numeric_token(tok):
-                try:
-                    row_vals.append(float(tok))
-                except Exception:
-                    row_vals.append(np.nan)
-            else:
-                row_vals.append(np.nan)
-        data.append(row_vals)
+    body_rows = norm_rows[1:] if header else norm_rows
+    # vectorized conversion: one pd.to_numeric pass per column instead of a
+    # regex match + float() round-trip per token; downcast to float32 since
+    # these are physical quantities nowhere near float64 precision, halving
+    # the memory each cached table and plot buffer drags around
+    data_df = pd.DataFrame(body_rows).apply(pd.to_numeric, errors="coerce",
+                                            downcast="float")
 
     cols = []
     if header:
@@ -231,12 +224,48 @@ def extract_numeric_table(text: str):
             cols = [f"col{i}" for i in range(max_cols)]
 
     try:
-        df = pd.DataFrame(data, columns=cols)
-        return df, (s + 1, e + 1)  # 1-based line numbers
+        data_df.columns = cols
+        return data_df, (s + 1, e + 1)  # 1-based line numbers
     except Exception:
         return None, None
 
 
+@st.cache_data
+def load_table_cached(path_str: str, mtime: float):
+    """Parse one file's numeric table, cached until the file changes on disk.
+
+    Keyed on (path, mtime) so widget interactions (slider drags, checkbox
+    toggles) reuse the parsed table instead of re-reading and re-tokenizing
+    every file; an edited file gets a new mtime and is re-parsed.
+    """
+    return extract_numeric_table(read_text(Path(path_str)))
+
+
+MAX_PLOT_POINTS = 2000
+
+
+def downsample_for_plot(df: pd.DataFrame):
+    """Stride-downsample a plot input to at most MAX_PLOT_POINTS rows.
+
+    With one point per parameter file this is a no-op today, but a bulk
+    sweep dumping tens of thousands of files would otherwise stall the
+    browser-side line rendering. Statistics and fits keep the full data;
+    only the drawn points are thinned.
+    """
+    if len(df) <= MAX_PLOT_POINTS:
+        return df
+    stride = len(df) // MAX_PLOT_POINTS
+    return df.iloc[::stride]
+
+
+def load_table(path: Path):
+    try:
+        mtime = path.stat().st_mtime
+    except Exception:
+        mtime = 0.0
+    return load_table_cached(str(path), mtime)
+
+
 st.set_page_config(page_title="Parameter-file comparer", layout="wide")
 st.title("Parameter-based Text File Comparer")
 
@@ -520,11 +549,9 @@ with tab_home:
 
     if selected_values and len(selected_values) >= 2:
         baseline_path = value_to_path[baseline_val]
-        baseline_text = read_text(baseline_path)
-        baseline_table, baseline_range = extract_numeric_table(baseline_text)
+        baseline_table, baseline_range = load_table(baseline_path)
     else:
         baseline_path = None
-        baseline_text = None
         baseline_table = None
         baseline_range = None
 
@@ -548,8 +575,7 @@ with tab_col:
     col_values_rows = []
     all_found_cols = set()
     for v, p in param_files[param_used]:
-        txt = read_text(p)
-        tbl, rng = extract_numeric_table(txt)
+        tbl, rng = load_table(p)
         # determine x-axis value for this file: if user selected the same param as filenames, use the parsed value;
         # otherwise, fall back to a default value from DEFAULT_PARAM_VALUES (from provided image/table).
         if override_enabled and override_value is not None:
@@ -571,6 +597,8 @@ with tab_col:
         col_values_rows.append(row)
 
     col_values_df = pd.DataFrame(col_values_rows)
+    _num_cols = col_values_df.select_dtypes(include="number").columns
+    col_values_df[_num_cols] = col_values_df[_num_cols].astype(np.float32)
 
     # candidate columns: defaults first, then any found in tables
     candidate_cols = [c for c in DEFAULT_COL_NAMES if c in all_found_cols] + [c for c in sorted(all_found_cols) if c not in DEFAULT_COL_NAMES]
@@ -581,8 +609,7 @@ with tab_col:
         if agg_method != "mean":
             # recompute according to selection
             for i, (v, p) in enumerate(param_files[param_used]):
-                txt = read_text(p)
-                tbl, rng = extract_numeric_table(txt)
+                tbl, rng = load_table(p)
                 if tbl is None:
                     continue
                 for c in tbl.columns:
@@ -724,70 +751,44 @@ with tab_col:
                 except Exception:
                     st.dataframe(stats_df, height=200)
 
-                # plotting: choose matplotlib style and palette according to theme
-                style_ctx = 'dark_background' if theme_choice == 'Dark' else 'default'
-                # build palette: use accent color as first color for custom theme, then tab10
-                cmap = plt.get_cmap('tab10')
-                palette = []
-                for i in range(len(ordered_cols)):
-                    if theme_choice == 'Custom' and i == 0:
-                        palette.append(accent_color)
-                    else:
-                        palette.append(mcolors.to_hex(cmap(i % 10)))
+                # plotting: Plotly renders in the browser, so reruns skip the
+                # figure + PNG rasterization cost matplotlib paid per interaction
+                template = 'plotly_dark' if theme_choice == 'Dark' else 'plotly'
+                # palette: use accent color as first color for custom theme, then the default cycle
+                color_seq = None
+                if theme_choice == 'Custom':
+                    color_seq = [accent_color] + px.colors.qualitative.Plotly
 
                 # use display-scaled x values for plotting and label axes with units
                 xlabel = format_xlabel(x_param if x_param is not None else param_used)
-                with plt.style.context(style_ctx):
-                    if combined_plot:
-                        fig3, ax3 = plt.subplots(figsize=(10, 5))
-                        for i, c in enumerate(ordered_cols):
-                            if c not in plot_df:
-                                continue
-                            s = stats.get(c, {})
-                            color = palette[i]
-                            unit = COLUMN_UNITS.get(c, "")
-                            label_unit = f" ({unit})" if unit else ""
-                            if not s.get("changing"):
-                                ax3.plot(display_xvals, plot_df[c], marker="o", label=f"{c}{label_unit} (no change)", linewidth=2, color="gray", linestyle="--", alpha=0.5)
-                            else:
-                                ax3.plot(display_xvals, plot_df[c], marker="o", label=f"{c}{label_unit}", linewidth=2, color=color, alpha=0.95)
-                        # ensure figure and axes use chosen background/text colors for custom theme
-                        if theme_choice == 'Custom':
-                            fig3.patch.set_facecolor(bg_color)
-                            ax3.set_facecolor(bg_color)
-                        ax3.set_xlabel(xlabel)
-                        ax3.set_ylabel("Column value")
-                        ax3.set_title(f"Selected columns vs {xlabel}")
-                        ax3.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-                        ax3.grid(True, alpha=0.3)
-                        fig3.tight_layout()
-                        st.pyplot(fig3)
-                    else:
-                        n = len(ordered_cols)
-                        fig4, axes = plt.subplots(n, 1, figsize=(10, 3 * n), sharex=True)
-                        if n == 1:
-                            axes = [axes]
-                        for i, c in enumerate(ordered_cols):
-                            axc = axes[i]
-                            s = stats.get(c, {})
-                            color = palette[i]
-                            unit = COLUMN_UNITS.get(c, "")
-                            if c in plot_df:
-                                if not s.get("changing"):
-                                    axc.plot(display_xvals, plot_df[c], marker="o", linewidth=2, color="gray", linestyle="--", alpha=0.5)
-                                else:
-                                    axc.plot(display_xvals, plot_df[c], marker="o", linewidth=2, color=color, alpha=0.95)
-                            ylabel = f"{c} ({unit})" if unit else c
-                            axc.set_ylabel(ylabel)
-                            title_suffix = " (no change)" if not s.get("changing") else ""
-                            axc.set_title(f"{c} vs {xlabel}{title_suffix}")
-                            if theme_choice == 'Custom':
-                                fig4.patch.set_facecolor(bg_color)
-                                axc.set_facecolor(bg_color)
-                            axc.grid(True, alpha=0.3)
-                        axes[-1].set_xlabel(xlabel)
-                        fig4.tight_layout()
-                        st.pyplot(fig4)
+                plot_cols = [c for c in ordered_cols if c in plot_df]
+                ds_df = downsample_for_plot(plot_df)
+                px_df = ds_df[plot_cols].copy()
+                px_df.insert(0, xlabel, ds_df["value"].to_numpy() * display_scale)
+                if combined_plot:
+                    fig3 = px.line(px_df, x=xlabel, y=plot_cols, markers=True,
+                                   template=template, color_discrete_sequence=color_seq,
+                                   title=f"Selected columns vs {xlabel}")
+                    fig3.update_layout(yaxis_title="Column value", legend_title_text="column")
+                    # mute columns that do not change, like the old gray dashed lines
+                    for c in plot_cols:
+                        if not stats.get(c, {}).get("changing"):
+                            fig3.update_traces(selector={"name": c}, opacity=0.5,
+                                               line={"color": "gray", "dash": "dash"})
+                    st.plotly_chart(fig3, use_container_width=True)
+                else:
+                    for c in plot_cols:
+                        s = stats.get(c, {})
+                        unit = COLUMN_UNITS.get(c, "")
+                        ylabel = f"{c} ({unit})" if unit else c
+                        title_suffix = " (no change)" if not s.get("changing") else ""
+                        figc = px.line(px_df, x=xlabel, y=c, markers=True,
+                                       template=template, color_discrete_sequence=color_seq,
+                                       title=f"{c} vs {xlabel}{title_suffix}")
+                        figc.update_yaxes(title_text=ylabel)
+                        if not s.get("changing"):
+                            figc.update_traces(opacity=0.5, line={"color": "gray", "dash": "dash"})
+                        st.plotly_chart(figc, use_container_width=True)
 
 st.write("---")
 st.caption("Pattern used to detect parameter files: `<param>_<value>.txt` (e.g., `V_rf_300.txt`). If you'd like different filename parsing or support for .mph files, tell me and I can extend this.")
@@ -804,8 +805,7 @@ with tab_fit:
     fit_rows = []
     fit_found_cols = set()
     for v, p in param_files[param_used]:
-        txt = read_text(p)
-        tbl, rng = extract_numeric_table(txt)
+        tbl, rng = load_table(p)
         if override_enabled and override_value is not None:
             xval = float(override_value)
         elif x_param is not None and param_used is not None and x_param.lower() == param_used.lower():
@@ -823,6 +823,8 @@ with tab_fit:
         fit_rows.append(row)
 
     fit_df = pd.DataFrame(fit_rows)
+    _fit_num_cols = fit_df.select_dtypes(include="number").columns
+    fit_df[_fit_num_cols] = fit_df[_fit_num_cols].astype(np.float32)
     fit_candidate_cols = [c for c in DEFAULT_COL_NAMES if c in fit_found_cols] + [c for c in sorted(fit_found_cols) if c not in DEFAULT_COL_NAMES]
 
     if not fit_candidate_cols:
@@ -861,17 +863,23 @@ with tab_fit:
             except Exception:
                 r = float('nan')
 
-            # plot
-            fig, ax = plt.subplots(figsize=(8, 5))
-            ax.scatter(x, y, label='data', color=accent_color if theme_choice == 'Custom' else 'tab:blue')
-            ax.plot(x, y_fit, label=f'fit: y={slope:.3g}x+{intercept:.3g}', color='red')
-            ax.set_xlabel(format_xlabel(x_param if x_param is not None else param_used))
+            # plot: interactive scatter + fit line rendered in the browser;
+            # the fit above used every row, only the drawn points are thinned
+            fd_plot = downsample_for_plot(fd)
+            x_plot = fd_plot["value"].to_numpy() * display_scale
+            y_plot = fd_plot[fit_col].to_numpy()
             unit = COLUMN_UNITS.get(fit_col, "")
-            ax.set_ylabel(f"{fit_col} ({unit})" if unit else fit_col)
-            ax.set_title(f"Best-fit for {fit_col} vs {x_param}")
-            ax.legend()
-            ax.grid(True, alpha=0.3)
-            fig.tight_layout()
-            st.pyplot(fig)
+            fig = px.scatter(x=x_plot, y=y_plot,
+                             template='plotly_dark' if theme_choice == 'Dark' else 'plotly',
+                             title=f"Best-fit for {fit_col} vs {x_param}")
+            fig.update_traces(name='data', showlegend=True)
+            if theme_choice == 'Custom':
+                fig.update_traces(marker={"color": accent_color})
+            fig.add_scatter(x=x_plot, y=slope * x_plot + intercept, mode='lines',
+                            name=f'fit: y={slope:.3g}x+{intercept:.3g}',
+                            line={"color": "red"})
+            fig.update_layout(xaxis_title=format_xlabel(x_param if x_param is not None else param_used),
+                              yaxis_title=f"{fit_col} ({unit})" if unit else fit_col)
+            st.plotly_chart(fig, use_container_width=True)
 
             st.markdown(f"**Slope:** {slope:.6g} — **Intercept:** {intercept:.6g} — **Pearson r:** {('nan' if r is None or np.isnan(r) else f'{r:.3f}')} ")